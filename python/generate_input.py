@@ -1,3 +1,8 @@
+import gzip
+import mmap
+import multiprocessing
+import os
+import pickle
 import re
 from pathlib import Path
 import sys
@@ -22,118 +27,203 @@ OUTPUT_DIR = Path(f"../benchmarks/input{file_number}")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
 EQUATIONS_DIR = Path("../benchmarks/Equations")
+EQUATION_INDEX_CACHE = EQUATIONS_DIR / ".index.pkl.gz"
+# Bump whenever build_equation_index or EQUATION_BLOCK_RE changes its output
+EQUATION_INDEX_CACHE_VERSION = 1
 
 # Regex patterns
 THEOREM_RE = re.compile(r"theorem\s+(Equation\d+)_implies_(Equation\d+)")
-EQUATION_START_RE = re.compile(r"equation\s+(\d+)\s*:=")
+# A block runs from "equation N :=" up to the next line starting with
+# "equation": the rest of the header line plus each following line that does
+# not start with "equation", so no position needs a lazy lookahead
+EQUATION_BLOCK_RE = re.compile(
+    rb"(?:^|\n)[^\S\n]*equation[^\S\n]+(\d+)[^\S\n]*:="
+    rb"([^\n]*(?:\n(?![^\S\n]*equation)[^\n]*)*)"
+)
+VARIABLE_RE = re.compile(r'\b[a-zA-Z_]\w*\b')
+STRUCTURE_RE = re.compile(r'[()◇]')
+
+# One equation body: its lines stripped and joined by single spaces
+def join_equation_body(body):
+    body = body.decode().strip()
+    # No control or line separator characters: already a single line
+    if body.isprintable():
+        return body
+    return " ".join(line.strip() for line in body.splitlines())
 
 # Parse multi-line Lean equations
 def build_equation_index():
     index = {}
     for file in EQUATIONS_DIR.glob("Eqns*.lean"):
-        lines = file.read_text().splitlines()
-        current_num = None
-        buffer = []
-        for line in lines:
-            line_strip = line.strip()
-            m = EQUATION_START_RE.match(line_strip)
-            if m:
-                if current_num is not None:
-                    index[current_num] = " ".join(buffer).strip()
-                current_num = int(m.group(1))
-                buffer = [line_strip.split(":=",1)[1].strip()]
-            elif current_num is not None:
-                if line_strip.startswith("equation"):
-                    index[current_num] = " ".join(buffer).strip()
-                    current_num = None
-                    buffer = []
-                else:
-                    buffer.append(line_strip)
-        if current_num is not None:
-            index[current_num] = " ".join(buffer).strip()
+        with open(file, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                continue
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for num, body in EQUATION_BLOCK_RE.findall(mm):
+                    index[int(num)] = join_equation_body(body)
+    return index
+
+# Reuse the index of the last run while no Eqns*.lean file has changed
+def load_equation_index():
+    sig = (EQUATION_INDEX_CACHE_VERSION, tuple(sorted(
+        (p.name, st.st_mtime_ns, st.st_size)
+        for p in EQUATIONS_DIR.glob("Eqns*.lean")
+        for st in (p.stat(),)
+    )))
+    try:
+        with gzip.open(EQUATION_INDEX_CACHE, "rb") as f:
+            cached_sig, index = pickle.load(f)
+        if cached_sig == sig:
+            return index
+    except Exception:
+        # Missing, truncated or foreign cache contents: rebuild
+        pass
+
+    index = build_equation_index()
+    tmp = EQUATION_INDEX_CACHE.with_name(f"{EQUATION_INDEX_CACHE.name}.{os.getpid()}")
+    try:
+        with gzip.open(tmp, "wb") as f:
+            pickle.dump((sig, index), f, protocol=5)
+        os.replace(tmp, EQUATION_INDEX_CACHE)
+    except OSError:
+        # A read-only Equations directory just means no cache
+        tmp.unlink(missing_ok=True)
     return index
 
-# Recursive infix ◇ -> prefix op
-def infix_to_prefix(expr: str) -> str:
+# Single-pass infix ◇ -> prefix op, renaming variables as they are emitted
+def parse_and_rename(expr: str, var_map: dict) -> str:
     """
     Convert Lean infix ◇ to prefix op(...) correctly, handling all nested parentheses.
+    Walks the parentheses and top-level ◇ once with an explicit stack; chains
+    associate to the right and a segment that is not a single parenthesised
+    group is kept verbatim. Variables are renamed to X0, X1, ... through
+    var_map in order of first appearance.
     """
-    expr = expr.strip()
-
-    # Remove outer parentheses fully
-    while expr.startswith('(') and expr.endswith(')'):
-        # Ensure matching parentheses
-        depth = 0
-        for i, c in enumerate(expr):
-            if c == '(':
-                depth += 1
-            elif c == ')':
-                depth -= 1
-            if depth == 0 and i < len(expr) - 1:
-                break
-        else:
-            expr = expr[1:-1].strip()
+    # Each frame: [converted segments, current segment start, last closed group, '(' index]
+    stack = [[[], 0, None, -1]]
+    last = 0
+    for m in STRUCTURE_RE.finditer(expr):
+        c = m.group(0)
+        i = m.start()
+        if c == '(':
+            # Text before a group (only in odd segments kept verbatim) must
+            # take its variable numbers before the group's contents do
+            if i > last and not expr[last:i].isspace():
+                _rename_all(expr[last:i], var_map)
+            stack.append([[], i + 1, None, i])
+            last = i + 1
+            continue
+        if c == ')' and len(stack) == 1:
+            # Unmatched ')' is left as ordinary text
             continue
-        break
+        last = i + 1
+        frame = stack[-1]
+        frame[0].append(_close_segment(expr, frame, i, var_map))
+        if c == '◇':
+            frame[1] = i + 1
+            frame[2] = None
+        else:
+            stack.pop()
+            stack[-1][2] = (frame[3], i + 1, _fold_op(frame[0]))
 
-    # Base case: no ◇
-    if '◇' not in expr:
-        return expr
+    if len(stack) != 1:
+        # Unbalanced '(' : leave the expression untouched
+        return _rename_all(expr.strip(), var_map)
+    frame = stack[0]
+    frame[0].append(_close_segment(expr, frame, len(expr), var_map))
+    return _fold_op(frame[0])
 
-    # Split at top-level ◇
-    depth = 0
-    for i, c in enumerate(expr):
-        if c == '(':
-            depth += 1
-        elif c == ')':
-            depth -= 1
-        elif c == '◇' and depth == 0:
-            left = expr[:i].strip()
-            right = expr[i+1:].strip()
-            left_conv = infix_to_prefix(left)
-            right_conv = infix_to_prefix(right)
-            return f"op({left_conv},{right_conv})"
-
-    # If no top-level ◇ found, recursively process inner expression
-    return expr
+def _close_segment(expr, frame, end, var_map):
+    """Return the converted text of the segment ending at end."""
+    seg = expr[frame[1]:end]
+    body = seg.strip()
+    group = frame[2]
+    if group is not None:
+        start = frame[1] + len(seg) - len(seg.lstrip())
+        # The segment is exactly one parenthesised group: use its conversion
+        if group[0] == start and group[1] == start + len(body):
+            return group[2]
+    if VARIABLE_RE.fullmatch(body):
+        return _rename(body, var_map)
+    return _rename_all(body, var_map)
+
+def _rename(v, var_map):
+    if v == "op":
+        return v
+    name = var_map.get(v)
+    if name is None:
+        name = var_map[v] = f"X{len(var_map)}"
+    return name
+
+def _rename_all(text, var_map):
+    """Rename every variable of a segment kept verbatim."""
+    return VARIABLE_RE.sub(lambda m: _rename(m.group(0), var_map), text)
+
+def _fold_op(parts):
+    """Fold [a, b, c] into op(a,op(b,c))."""
+    if len(parts) == 1:
+        return parts[0]
+    out = [f"op({p}," for p in parts[:-1]]
+    out.append(parts[-1])
+    out.append(")" * (len(parts) - 1))
+    return "".join(out)
 
 # Map variables to TPTP
 def lean_expr_to_tptp(expr: str):
     expr = expr.strip()
 
-    # Split at '='
-    if '=' not in expr:
-        lhs, rhs = '', expr
-    else:
-        lhs, rhs = expr.split('=', 1)
-        lhs = lhs.strip()
-        rhs = rhs.strip()
-
-    # Convert ◇ to nested op
-    lhs = infix_to_prefix(lhs)
-    rhs = infix_to_prefix(rhs)
+    # Split at the first '='
+    lhs, eq, rhs = expr.partition('=')
+    if not eq:
+        lhs, rhs = '', lhs
 
-    # Map variables
+    # One var_map threaded through both sides, so numbering carries over
     var_map = {}
-    counter = 0
-    def repl(m):
-        nonlocal counter
-        v = m.group(0)
-        if v == "op":
-            return v
-        if v not in var_map:
-            var_map[v] = f"X{counter}"
-            counter += 1
-        return var_map[v]
-
-    lhs = re.sub(r'\b[a-zA-Z_]\w*\b', repl, lhs)
-    rhs = re.sub(r'\b[a-zA-Z_]\w*\b', repl, rhs)
+    lhs = parse_and_rename(lhs.strip(), var_map)
+    rhs = parse_and_rename(rhs.strip(), var_map)
 
     return f"({lhs} = {rhs})", list(var_map.values())
 
+# An equation appears in many theorems: convert and encode each one only once
+def convert_equation(eq_num: int):
+    tptp, tptp_vars = lean_expr_to_tptp(EQUATION_INDEX[eq_num])
+    return tptp.encode(), tuple(tptp_vars)
+
+# A conversion takes about 15 us: below this many distinct equations,
+# forking a pool costs more than it saves
+PARALLEL_MIN_EQUATIONS = 4096
+
+def convert_equations(eq_nums):
+    """Return {eq_num: convert_equation(eq_num)} for the given equations."""
+    workers = os.cpu_count() or 1
+    if workers == 1 or len(eq_nums) < PARALLEL_MIN_EQUATIONS:
+        return {n: convert_equation(n) for n in eq_nums}
+    # Forked workers inherit EQUATION_INDEX; large chunks amortize IPC
+    chunksize = max(1, min(1024, len(eq_nums) // (workers * 4)))
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        return dict(zip(eq_nums, pool.map(convert_equation, eq_nums, chunksize)))
+
+# Output problem, assembled from these pieces around the variables and formulas
+TPTP_AXIOM_HEAD = b"fof(a1, axiom,\n    ! ["
+TPTP_FORALL_END = b"] :\n        "
+TPTP_CONJECTURE_HEAD = b"\n).\n\nfof(conjecture0, conjecture,\n    ! ["
+TPTP_TAIL = b"\n).\n"
+
+# Write one output file relative to an already opened directory
+OUTPUT_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+
+def write_output(dir_fd, name, data: bytes):
+    fd = os.open(name, OUTPUT_FLAGS, 0o644, dir_fd=dir_fd)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
 # Main
 print("Indexing equations...")
-EQUATION_INDEX = build_equation_index()
+EQUATION_INDEX = load_equation_index()
 print(f"Indexed {len(EQUATION_INDEX)} equations")
 
 proofs_text = PROOFS_FILE.read_text()
@@ -142,6 +232,7 @@ print(f"Found {len(theorems)} theorems")
 
 written = 0
 skipped = 0
+pending = []
 
 for ax_name, conj_name in theorems:
     ax_num = int(ax_name.replace("Equation", ""))
@@ -152,30 +243,30 @@ for ax_name, conj_name in theorems:
         skipped += 1
         continue
 
-    ax_expr = EQUATION_INDEX[ax_num]
-    conj_expr = EQUATION_INDEX[conj_num]
+    pending.append((ax_name, ax_num, conj_name, conj_num))
 
-    ax_tptp, ax_vars = lean_expr_to_tptp(ax_expr)
-    conj_tptp, conj_vars = lean_expr_to_tptp(conj_expr)
+converted = convert_equations(list({n for t in pending for n in (t[1], t[3])}))
 
-    all_vars = sorted(set(ax_vars + conj_vars))
-    vars_str = ", ".join(all_vars)
+output_dir_fd = os.open(OUTPUT_DIR, os.O_RDONLY | os.O_DIRECTORY)
 
-    tptp_text = f"""fof(a1, axiom,
-    ! [{vars_str}] :
-        {ax_tptp}
-).
+for ax_name, ax_num, conj_name, conj_num in pending:
+    ax_tptp, ax_vars = converted[ax_num]
+    conj_tptp, conj_vars = converted[conj_num]
 
-fof(conjecture0, conjecture,
-    ! [{vars_str}] :
-        {conj_tptp}
-).
-"""
+    all_vars = sorted(set(ax_vars + conj_vars))
+    vars_bytes = ", ".join(all_vars).encode()
+
+    tptp_bytes = b"".join((
+        TPTP_AXIOM_HEAD, vars_bytes, TPTP_FORALL_END, ax_tptp,
+        TPTP_CONJECTURE_HEAD, vars_bytes, TPTP_FORALL_END, conj_tptp,
+        TPTP_TAIL,
+    ))
 
-    out_file = OUTPUT_DIR / f"{ax_name}_implies_{conj_name}.p"
-    out_file.write_text(tptp_text)
+    write_output(output_dir_fd, f"{ax_name}_implies_{conj_name}.p", tptp_bytes)
     written += 1
 
+os.close(output_dir_fd)
+
 print("\nDone.")
 print(f"Written: {written}")
 print(f"Skipped: {skipped}")
@@ -0,0 +1,9 @@
+# Build the Cython parsing core next to tolean_core.py:
+#   python setup_core.py build_ext --inplace
+from Cython.Build import cythonize
+from setuptools import setup
+
+setup(
+    name="tolean_core",
+    ext_modules=cythonize("tolean_core.pyx", language_level=3),
+)
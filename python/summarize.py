@@ -1,65 +1,75 @@
 import os
 import re
+import mmap
 import argparse
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+
+# At most one record per line: the ^[^\n]*? prefix takes the first one only
 LINE_RE = re.compile(
-    r"Vampire:\s+(\d+)\s+Minimized:\s+(N/A|\d+)"
+    rb"^[^\n]*?Vampire:[^\S\n]+(\d+)[^\S\n]+Minimized:[^\S\n]+(N/A|\d+)",
+    re.MULTILINE,
 )
 
+def scan_log(path):
+    """Return the vampire, minimized pairs of one log file, interleaved as int64."""
+    hits = array("q")
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hits
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for match in LINE_RE.finditer(mm):
+                vampire = int(match.group(1))
+                minimized_raw = match.group(2)
+                minimized = vampire if minimized_raw == b"N/A" else int(minimized_raw)
+                hits.append(vampire)
+                hits.append(minimized)
+    return hits
+
 def summarize(vamps, mins):
-    if not vamps:
+    if vamps.size == 0:
         return 0, 0.0, 0.0
     return (
-        len(vamps),
-        sum(vamps) / len(vamps),
-        sum(mins) / len(mins),
+        vamps.size,
+        vamps.mean(),
+        mins.mean(),
     )
 
 def main(log_dir):
-    overall_all_v = []
-    overall_all_m = []
-    overall_15_v = []
-    overall_15_m = []
-
-    for filename in sorted(os.listdir(log_dir)):
-        if not filename.endswith(".log"):
-            continue
-
-        file_all_v = []
-        file_all_m = []
-        file_15_v = []
-        file_15_m = []
-
-        with open(os.path.join(log_dir, filename), "r") as f:
-            for line in f:
-                match = LINE_RE.search(line)
-                if not match:
-                    continue
-
-                vampire = int(match.group(1))
-                minimized_raw = match.group(2)
-                minimized = vampire if minimized_raw == "N/A" else int(minimized_raw)
-
-                # per-file
-                file_all_v.append(vampire)
-                file_all_m.append(minimized)
-
-                if vampire >= 15:
-                    file_15_v.append(vampire)
-                    file_15_m.append(minimized)
-
-                # overall
-                overall_all_v.append(vampire)
-                overall_all_m.append(minimized)
-
-                if vampire >= 15:
-                    overall_15_v.append(vampire)
-                    overall_15_m.append(minimized)
-
-        # ---- per-file output ----
-        c, av, am = summarize(file_all_v, file_all_m)
-        c15, av15, am15 = summarize(file_15_v, file_15_m)
-
+    # per-file arrays, concatenated once for the overall summary
+    overall_v_parts = [np.empty(0, dtype=np.int64)]
+    overall_m_parts = [np.empty(0, dtype=np.int64)]
+
+    with os.scandir(log_dir) as it:
+        entries = [e for e in it if e.is_file() and e.name.endswith(".log")]
+
+    # Overlap the per-file open/map I/O; files are taken in directory order
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = pool.map(scan_log, [e.path for e in entries])
+
+    per_file = []
+    for entry, hits in zip(entries, results):
+        hits = np.frombuffer(hits, dtype=np.int64).reshape(-1, 2)
+        file_all_v = hits[:, 0]
+        file_all_m = hits[:, 1]
+
+        above = file_all_v >= 15
+        file_15_v = file_all_v[above]
+        file_15_m = file_all_m[above]
+
+        overall_v_parts.append(file_all_v)
+        overall_m_parts.append(file_all_m)
+
+        per_file.append((
+            entry.name,
+            summarize(file_all_v, file_all_m),
+            summarize(file_15_v, file_15_m),
+        ))
+
+    # ---- per-file output, in file name order ----
+    for filename, (c, av, am), (c15, av15, am15) in sorted(per_file):
         print(f"\n=== {filename} ===")
         print("ALL:")
         print(f"  Count: {c}")
@@ -72,6 +82,13 @@ def main(log_dir):
         print(f"  Avg Minimized: {am15:.2f}")
 
     # ---- overall output ----
+    overall_all_v = np.concatenate(overall_v_parts)
+    overall_all_m = np.concatenate(overall_m_parts)
+
+    above = overall_all_v >= 15
+    overall_15_v = overall_all_v[above]
+    overall_15_m = overall_all_m[above]
+
     c, av, am = summarize(overall_all_v, overall_all_m)
     c15, av15, am15 = summarize(overall_15_v, overall_15_m)
 
@@ -1,36 +1,67 @@
 import re
 import sys
 import os
+import mmap
+import stat
+import contextlib
+
+# Regex patterns
+LEMMA_REF_RE = re.compile(r'by lemma (\d+)', re.IGNORECASE)
+FORALL_RE = re.compile(r"!\s*\[.*?\]\s*:\s*(.*)")
+AXIOM_RE = re.compile(r"Axiom\s+\d+\s+\(([^)]+)\):\s*(.*)")
+GOAL_RE = re.compile(r'(?:Goal|Lemma)\s+(\d+)(?:\s*\(([^)]+)\))?\s*:\s*(.*)')
+GOAL_START_RE = re.compile(r'(?:Goal|Lemma)\s+\d+')
+STEP_LEMMA_RE = re.compile(r"%\s*(\S+):\s*(.*)")
+FOF_NAME_RE = re.compile(r"fof\(([^,]+)")
+FOF_FORMULA_RE = re.compile(r"fof\([^,]+,[^,]+,(.*)\)\s*\.", re.DOTALL)
+# Input lines, read straight from the mapped file
+LINE_RE = re.compile(rb"[^\n]*\n?")
+# Before the proof only these lines matter: inline axioms, lemma steps,
+# the proof marker and fof( blocks
+HEADER_LINE_RE = re.compile(
+    rb"^(?:[ \t\r\f\v]*(?:Axiom|% single_lemma_|% history_lemma_"
+    rb"|The conjecture is true! Here is a proof)|[^\n]*?fof\()[^\n]*\n?",
+    re.MULTILINE,
+)
+
+# Load the parsing core. "python setup_core.py build_ext --inplace" compiles
+# tolean_core.pyx into an extension module, which a plain import prefers over
+# tolean_core.py. KRYMPA_CYTHON=True requires the compiled core,
+# KRYMPA_CYTHON=False forces the pure Python one.
+def load_pure_core():
+    import importlib.util
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tolean_core.py")
+    spec = importlib.util.spec_from_file_location("tolean_core", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def load_core():
+    flag = os.environ.get("KRYMPA_CYTHON", "").strip().lower()
+    if flag == "false":
+        return load_pure_core()
+    try:
+        import tolean_core
+    except ImportError:
+        # A compiled core that fails to load (e.g. a stale build)
+        if flag == "true":
+            raise
+        return load_pure_core()
+    if flag == "true" and tolean_core.__file__.endswith(".py"):
+        raise ImportError(
+            "KRYMPA_CYTHON=True but tolean_core is not compiled; "
+            "run: python setup_core.py build_ext --inplace"
+        )
+    return tolean_core
 
-# Recursive parser for op(...) terms into Lean infix ◇
-def parse_term(s, i=0):
-    n = len(s)
-    while i < n and s[i].isspace():
-        i += 1
-    if i >= n:
-        raise ValueError("Unexpected end while parsing term")
-
-    if s.startswith("op(", i):
-        i += 3
-        left, i = parse_term(s, i)
-        while i < n and s[i].isspace():
-            i += 1
-        if i >= n or s[i] != ',':
-            raise ValueError(f"Expected ',' in op(...) at pos {i} in: {s}")
-        i += 1
-        right, i = parse_term(s, i)
-        while i < n and s[i].isspace():
-            i += 1
-        if i >= n or s[i] != ')':
-            raise ValueError(f"Expected ')' in op(...) at pos {i} in: {s}")
-        i += 1
-        return f"({left} ◇ {right})", i
-
-    m = re.match(r'[A-Za-z]\w*', s[i:])
-    if not m:
-        raise ValueError(f"Expected variable at pos {i} in: {s}")
-    ident = m.group(0)
-    return ident, i + len(ident)
+core = load_core()
+DEP_RE = core.DEP_RE
+parse_term = core.parse_term
+normalize_variables = core.normalize_variables
+canonical_variables = core.canonical_variables
+apply_renaming = core.apply_renaming
+calc_step_ref = core.calc_step_ref
+build_calc_block = core.build_calc_block
 
 def parse_side(side_text):
     side_text = side_text.strip().rstrip('.')
@@ -66,56 +97,24 @@ def parse_equation_tptp(eq):
 
 # Strip TPTP universal quantifiers ! [X,Y,...] :
 def strip_forall(expr):
-    m = re.match(r"!\s*\[.*?\]\s*:\s*(.*)", expr)
+    m = FORALL_RE.match(expr)
     if m:
         return m.group(1).strip()
     return expr.strip()
 
-# Extract variables
-def extract_variables(s):
-    vars = sorted(set(re.findall(r"[A-Za-z]\w*", s)))
-    if 'op' in vars:
-        vars.remove('op')
-    return vars
-
 # Parse dependencies from proof lines
 def parse_dependencies_from_proof(proof_lines):
     deps = set()
-    for line in proof_lines:
-        matches = re.findall(r'\((single_lemma_\d+|history_lemma_\d+|a1)\)', line)
+    for line, _ in proof_lines:
+        matches = DEP_RE.findall(line)
         for m in matches:
-            deps.add("op_law" if m == "a1" else m)
+            deps.add("op_law" if m == "a1" else sys.intern(m))
 
-        matches2 = re.findall(r'by lemma (\d+)', line, flags=re.IGNORECASE)
+        matches2 = LEMMA_REF_RE.findall(line)
         for m in matches2:
-            deps.add(f"Lemma_{m}")
+            deps.add(sys.intern(f"Lemma_{m}"))
     return sorted(deps)
 
-def normalize_variables(expr):
-    """
-    Renames variables in expr to x0, x1, x2, ... in sorted order.
-    Variable matching is case-insensitive: X and x map to the same variable.
-    Returns (new_expr, new_vars)
-    """
-
-    # Extract variables, normalize case
-    raw_vars = re.findall(r"[A-Za-z]\w*", expr)
-
-    # Remove 'op' and normalize to lowercase
-    canon_vars = sorted({v.lower() for v in raw_vars if v.lower() != "op"})
-
-    # Canonical renaming
-    renaming = {v: f"x{i}" for i, v in enumerate(canon_vars)}
-
-    def repl(match):
-        v = match.group(0)
-        return renaming.get(v.lower(), v)
-
-    new_expr = re.sub(r"[A-Za-z]\w*", repl, expr)
-    new_vars = [renaming[v] for v in canon_vars]
-
-    return new_expr, new_vars
-
 # Lean abbreviation
 def lean_abbrev(name, expr):
     expr_core = strip_forall(expr)
@@ -153,33 +152,9 @@ def build_variable_renaming_from_expr(expr):
     Build a variable renaming map from the lemma expression only.
     Case-insensitive: X and x are the same variable.
     """
-    vars = sorted(
-        set(v.lower() for v in extract_variables(expr))
-        - {"op"}
-    )
-    return {v: f"x{i}" for i, v in enumerate(vars)}
-
-def apply_renaming(expr, renaming):
-    def repl(match):
-        v = match.group(0)
-        return renaming.get(v.lower(), v)
-    return re.sub(r"[A-Za-z]\w*", repl, expr)
-
-def format_calc_step(lhs, rhs, dep, indent="        ", max_len=80):
-    expr_len = len(lhs) + len(rhs)
-
-    if expr_len <= max_len:
-        return (
-            f"{lhs} = {rhs} := by\n"
-            f"{indent}duper [{dep}]"
-        )
-    else:
-        return (
-            f"{lhs} =\n"
-            f"{indent}{rhs} := by\n"
-            f"{indent}duper [{dep}]"
-        )
-    
+    vars = canonical_variables(expr, expr.lower())
+    return {sys.intern(v): sys.intern(f"x{i}") for i, v in enumerate(vars)}
+
 def format_lemma_body(lhs, rhs, indent="  ", max_len=80):
     """
     Format the body of a lemma:
@@ -225,64 +200,6 @@ def format_side(expr, indent="      ", max_len=80):
     # Join with newline + indent
     return ("\n" + indent).join(lines)
 
-def build_calc_block(proof_lines, renaming):
-    """
-    Builds Lean calc block from TPTP proof lines.
-    Each step may have:
-      lhs
-      = { by <dep> }
-      rhs
-
-    Converts to:
-      lhs = rhs := by duper [dep]
-    """
-    lines = []
-
-    for i in range(len(proof_lines)):
-        line = proof_lines[i].strip()
-        if not line or line.lower() == "proof:":
-            continue
-
-        
-        # Look for a dependency line like "= { by ... }"
-        m = re.match(r"=\s*\{\s*by\s+(\S+).*?\}", line)
-        if m:
-            # Determine dependency (only the first reference)
-            refs = re.findall(r"(single_lemma_\d+|history_lemma_\d+|a1)", line)
-            dep = None
-            if refs:
-                r = refs[0]
-                if r == "a1":
-                    dep = "op_law"
-                elif r in name_mapping:
-                    dep = name_mapping[r]
-                else:
-                    dep = r
-            else:
-                # Next, try "lemma N" pattern
-                m2 = re.search(r"lemma\s+(\d+)", line, flags=re.IGNORECASE)
-                if m2:
-                    dep_num = m2.group(1)
-                    # Original TPTP name may be "lemma_3", map via name_mapping
-                    original_name = f"Lemma_{dep_num}"  # depends on how TPTP numbered lemmas
-                    dep = name_mapping.get(original_name, f"lemma_{dep_num}")
-                else:
-                    # fallback: just take first word and translate if possible
-                    dep = name_mapping.get(line.split()[0], line.split()[0])
-
-            lhs_raw = apply_renaming(proof_lines[i - 1], renaming)
-            rhs_raw = apply_renaming(proof_lines[i + 1], renaming)
-
-            lhs, _ = parse_term(lhs_raw)
-            rhs, _ = parse_term(rhs_raw)
-
-            lines.append(format_calc_step(lhs, rhs, dep))
-            # lines.append(f"{lhs} = {rhs} := by\n        duper [{dep}]")
-            #lines.append(f"_ = {rhs_norm} := by\n        duper [{dep}]")
-
-    return "\n      ".join(lines)
-    
-
 # Lean lemma with dependencies (works for lemmas and conjecture)
 def lean_lemma(name, expr, deps_from_proof=[], proof_lines=None):
     expr_core = strip_forall(expr)
@@ -296,7 +213,7 @@ def lean_lemma(name, expr, deps_from_proof=[], proof_lines=None):
     body = format_lemma_body(lhs, rhs, indent="      ", max_len=80)
 
     if name.startswith("lemma_") and proof_lines:
-        calc_block = build_calc_block(proof_lines, renaming)
+        calc_block = build_calc_block(proof_lines, renaming, name_mapping)
         return f"""     
   have {name} ({var_list} : G) :
   {body} := by
@@ -305,7 +222,7 @@ def lean_lemma(name, expr, deps_from_proof=[], proof_lines=None):
   """
 
     if name.startswith("conjecture") and proof_lines:
-        calc_block = build_calc_block(proof_lines, renaming)
+        calc_block = build_calc_block(proof_lines, renaming, name_mapping)
         intros = " ".join(vars)
         return f"""
   show _ by
@@ -346,107 +263,128 @@ current_proof_lines = []
 current_lemmaname = None
 proofs_by_lemma = {}  # lemma_name -> list of proof lines
 
-with open(input_file) as f:
-    for line in f:
-        stripped = line.strip()
-
-        # Inline axioms like: Axiom 2 (a1): op(X, ...)
-        m = re.match(r"Axiom\s+\d+\s+\(([^)]+)\):\s*(.*)", stripped)
-        if m:
-            ax_name = m.group(1)
-            ax_expr = m.group(2).rstrip(".")
-            inline_axioms[ax_name] = ax_expr
-            continue
-
-        # Start proof section
-        if stripped.startswith("The conjecture is true! Here is a proof"):
-            proof_section = True
-            continue
-
-        # Lemmas
-        if stripped.startswith("% single_lemma_") or stripped.startswith("% history_lemma_"):
-            parts = stripped.split("|")
-            body = parts[0]
-            deps_part = parts[1] if len(parts) > 1 else ""
-            m = re.match(r"%\s*(\S+):\s*(.*)", body)
-            if m:
-                name, expr = m.group(1), m.group(2)
-                deps = []
-                if "deps:" in deps_part:
-                    for d in deps_part.split("deps:")[1].split(","):
-                        d = d.split("->")[0].strip()
-                        deps.append("op_law" if d == "a1" else d)
-                lemmas[name] = (expr, deps)
-            continue
-
-        # Parse proof goals if in proof section
-        if proof_section:
-            m = re.match(r'(?:Goal|Lemma)\s+(\d+)(?:\s*\(([^)]+)\))?\s*:\s*(.*)', stripped)
-            if m:
-                # If there is a current lemma being accumulated, finalize it
-                if current_proof_lines and current_lemmaname:
-                    proofs_by_lemma[current_lemmaname] = current_proof_lines.copy()
-                    deps = parse_dependencies_from_proof(current_proof_lines)
-                    expr, _ = lemmas[current_lemmaname]
-                    lemmas[current_lemmaname] = (expr, deps)
-                    current_proof_lines = []
-
-                # Start new lemma
-                number = m.group(1)
-                current_lemmaname = m.group(2) if m.group(2) else f"Lemma_{number}"
-                lemmaexpr = m.group(3).strip()
-                current_proof_lines = []
+with open(input_file, "rb") as f:
+    st = os.fstat(f.fileno())
+    # Map regular files; read pipes and other streams, and empty files,
+    # which mmap cannot map
+    if stat.S_ISREG(st.st_mode) and st.st_size:
+        source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        source = contextlib.nullcontext(f.read())
+    with source as data:
+        pos = 0
+        while pos < len(data):
+            # Outside the proof and fof( blocks, jump to the next line that matters
+            if proof_section or buffer:
+                m = LINE_RE.match(data, pos)
+            else:
+                m = HEADER_LINE_RE.search(data, pos)
+                if m is None:
+                    break
+            pos = m.end()
+            stripped = m.group(0).decode().strip()
+
+            # Inline axioms like: Axiom 2 (a1): op(X, ...)
+            if stripped.startswith("Axiom"):
+                m = AXIOM_RE.match(stripped)
+                if m:
+                    ax_name = m.group(1)
+                    ax_expr = m.group(2).rstrip(".")
+                    inline_axioms[ax_name] = ax_expr
+                    continue
+
+            # Start proof section
+            if stripped.startswith("The conjecture is true! Here is a proof"):
+                proof_section = True
+                continue
 
-                # Initialize lemma if not 'a1' (hypothesis)
-                if "a1" not in current_lemmaname.lower():
-                    lemmas[current_lemmaname] = (lemmaexpr, [])
+            # Lemmas
+            if stripped.startswith("% single_lemma_") or stripped.startswith("% history_lemma_"):
+                parts = stripped.split("|")
+                body = parts[0]
+                deps_part = parts[1] if len(parts) > 1 else ""
+                m = STEP_LEMMA_RE.match(body)
+                if m:
+                    name, expr = sys.intern(m.group(1)), m.group(2)
+                    deps = []
+                    if "deps:" in deps_part:
+                        for d in deps_part.split("deps:")[1].split(","):
+                            d = d.split("->")[0].strip()
+                            deps.append("op_law" if d == "a1" else sys.intern(d))
+                    lemmas[name] = (expr, deps)
                 continue
 
-            # Accumulate proof lines
-            if current_lemmaname:
-                if stripped and not stripped.startswith("Goal") and not stripped.startswith("Lemma") and not stripped.startswith("RESULT"):
-                    current_proof_lines.append(stripped)
-                    # detect usage of inline axioms or lemmas
-                    matches = re.findall(r'\((single_lemma_\d+|history_lemma_\d+|a1)\)', stripped)
-                    for ax in matches:
-                        used_inline_axioms.add(ax)
-
-
-            # Finalize current lemma if next Goal/Lemma or RESULT
-            if re.match(r'(?:Goal|Lemma)\s+\d+', stripped) or stripped.startswith("RESULT"):
-                if current_lemmaname and current_proof_lines:
-                    proofs_by_lemma[current_lemmaname] = current_proof_lines.copy()
-                    deps = parse_dependencies_from_proof(current_proof_lines)
-                    expr, _ = lemmas[current_lemmaname]
-                    lemmas[current_lemmaname] = (expr, deps)
+            # Parse proof goals if in proof section
+            if proof_section:
+                # Cheap prefix test before running the regex on every proof line
+                is_goal = stripped.startswith(("Goal", "Lemma"))
+                m = GOAL_RE.match(stripped) if is_goal else None
+                if m:
+                    # If there is a current lemma being accumulated, finalize it
+                    if current_proof_lines and current_lemmaname:
+                        proofs_by_lemma[current_lemmaname] = current_proof_lines.copy()
+                        deps = parse_dependencies_from_proof(current_proof_lines)
+                        expr, _ = lemmas[current_lemmaname]
+                        lemmas[current_lemmaname] = (expr, deps)
+                        current_proof_lines = []
+
+                    # Start new lemma
+                    number = m.group(1)
+                    current_lemmaname = sys.intern(m.group(2) if m.group(2) else f"Lemma_{number}")
+                    lemmaexpr = m.group(3).strip()
                     current_proof_lines = []
 
-        # Accumulate fof(...) blocks
-        if "fof(" in stripped:
-            buffer = stripped
-            if buffer.endswith(")."):
-                name = re.search(r"fof\(([^,]+)", buffer).group(1)
-                formula_match = re.search(r"fof\([^,]+,[^,]+,(.*)\)\s*\.", buffer, re.DOTALL)
-                if formula_match:
-                    formula = formula_match.group(1).strip()
-                    if "axiom" in buffer:
-                        axiom = (name, formula)
-                    elif "conjecture" in buffer:
-                        conjecture = (name, formula)
-                buffer = ""
-            continue
-        elif buffer:
-            buffer += " " + stripped
-            if buffer.endswith(")."):
-                name = re.search(r"fof\(([^,]+)", buffer).group(1)
-                formula_match = re.search(r"fof\([^,]+,[^,]+,(.*)\)\s*\.", buffer, re.DOTALL)
-                if formula_match:
-                    formula = formula_match.group(1).strip()
-                    if "axiom" in buffer:
-                        axiom = (name, formula)
-                    elif "conjecture" in buffer:
-                        conjecture = (name, formula)
-                buffer = ""
+                    # Initialize lemma if not 'a1' (hypothesis)
+                    if "a1" not in current_lemmaname.lower():
+                        lemmas[current_lemmaname] = (lemmaexpr, [])
+                    continue
+
+                # Accumulate proof lines
+                if current_lemmaname:
+                    if stripped and not is_goal and not stripped.startswith("RESULT"):
+                        current_proof_lines.append((stripped, calc_step_ref(stripped)))
+                        # detect usage of inline axioms or lemmas
+                        if ("(single_lemma_" in stripped or "(history_lemma_" in stripped
+                                or "(a1)" in stripped):
+                            for ax in DEP_RE.findall(stripped):
+                                used_inline_axioms.add(sys.intern(ax))
+
+
+                # Finalize current lemma if next Goal/Lemma or RESULT
+                if (is_goal and GOAL_START_RE.match(stripped)) or stripped.startswith("RESULT"):
+                    if current_lemmaname and current_proof_lines:
+                        proofs_by_lemma[current_lemmaname] = current_proof_lines.copy()
+                        deps = parse_dependencies_from_proof(current_proof_lines)
+                        expr, _ = lemmas[current_lemmaname]
+                        lemmas[current_lemmaname] = (expr, deps)
+                        current_proof_lines = []
+
+            # Accumulate fof(...) blocks
+            if "fof(" in stripped:
+                buffer = stripped
+                if buffer.endswith(")."):
+                    name = FOF_NAME_RE.search(buffer).group(1)
+                    formula_match = FOF_FORMULA_RE.search(buffer)
+                    if formula_match:
+                        formula = formula_match.group(1).strip()
+                        if "axiom" in buffer:
+                            axiom = (name, formula)
+                        elif "conjecture" in buffer:
+                            conjecture = (name, formula)
+                    buffer = ""
+                continue
+            elif buffer:
+                buffer += " " + stripped
+                if buffer.endswith(")."):
+                    name = FOF_NAME_RE.search(buffer).group(1)
+                    formula_match = FOF_FORMULA_RE.search(buffer)
+                    if formula_match:
+                        formula = formula_match.group(1).strip()
+                        if "axiom" in buffer:
+                            axiom = (name, formula)
+                        elif "conjecture" in buffer:
+                            conjecture = (name, formula)
+                    buffer = ""
 
 if axiom is None or conjecture is None:
     print("ERROR: Missing axiom or conjecture in TPTP")
@@ -462,7 +400,7 @@ for ax in sorted(used_inline_axioms):
     # If this axiom is already a lemma, skip it
     if ax in lemmas:
         continue
-    axiom_name_map[ax] = f"axiom{axiom_counter}"
+    axiom_name_map[ax] = sys.intern(f"axiom{axiom_counter}")
     axiom_counter += 1
 
 # Normalize lemma names
@@ -474,7 +412,7 @@ for old_name in lemmas.keys():
     if old_name.startswith("conjecture"):
         new_name = old_name
     else:
-        new_name = f"lemma_{counter}"
+        new_name = sys.intern(f"lemma_{counter}")
         counter += 1
     name_mapping[old_name] = new_name
     normalized_lemmas[new_name] = lemmas[old_name]
@@ -520,17 +458,18 @@ theorem_header = (
 )
 
 # Add only axioms that were not proven as lemmas
-lean_axioms = ""
-for old, new in axiom_name_map.items():
-    lean_axioms += lean_axiom(new, inline_axioms[old])
-
-# Add lemmas
-lemma_text = ""
-for lemmaname, (expr, deps) in lemmas.items():
-    proof_lines = proofs_by_lemma.get(lemmaname)
-    lemma_text += lean_lemma(lemmaname, expr, deps, proof_lines)
-
-lean_output = f"""import Mathlib.Tactic.NthRewrite
+axiom_chunks = [
+    lean_axiom(new, inline_axioms[old]).encode()
+    for old, new in axiom_name_map.items()
+]
+
+# Add lemmas, each encoded on its own so no combined text is ever built
+lemma_chunks = [
+    lean_lemma(lemmaname, expr, deps, proofs_by_lemma.get(lemmaname)).encode()
+    for lemmaname, (expr, deps) in lemmas.items()
+]
+
+LEAN_PREAMBLE = """import Mathlib.Tactic.NthRewrite
 import Duper
 open Lean Grind
 
@@ -539,13 +478,19 @@ class Magma (α : Type _) where
 
 infix:65 " ◇ " => Magma.op
 
-{lean_ax}
-{lean_axioms}
-{lean_conj}
-{theorem_header}{lemma_text}
-"""
-
-with open(output_file, "w") as f:
-    f.write(lean_output)
+""".encode()
+
+# Stream the sections out through one large buffer
+with open(output_file, "wb", buffering=1 << 20) as f:
+    f.write(LEAN_PREAMBLE)
+    f.write(lean_ax.encode())
+    f.write(b"\n")
+    f.writelines(axiom_chunks)
+    f.write(b"\n")
+    f.write(lean_conj.encode())
+    f.write(b"\n")
+    f.write(theorem_header.encode())
+    f.writelines(lemma_chunks)
+    f.write(b"\n")
 
 print("✓ Generated Lean file:", output_file)
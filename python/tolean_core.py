@@ -0,0 +1,197 @@
+# Parsing core of tolean.py: op(...) terms, variable renaming, calc blocks
+# and the proof-step patterns.
+# tolean_core.pyx is the Cython build of the same functions; keep them in sync.
+import re
+import sys
+
+try:
+    # regex has possessive quantifiers on any Python; re only from 3.11
+    import regex as re2
+    POSSESSIVE = True
+except ImportError:
+    re2 = re
+    POSSESSIVE = sys.version_info >= (3, 11)
+
+# Regex patterns
+IDENT_RE = re.compile(r'[A-Za-z]\w*')
+DEP_RE = re2.compile(
+    r'\((single_lemma_\d++|history_lemma_\d++|a1)\)' if POSSESSIVE
+    else r'\((single_lemma_\d+|history_lemma_\d+|a1)\)'
+)
+# "= { by <dep> ... }": the [^}] scan bounds backtracking, possessive
+# runs (where supported) remove it
+CALC_DEP_RE = re2.compile(
+    r"=\s*+\{\s*+by\s++\S[^}]*+\}" if POSSESSIVE
+    else r"=\s*\{\s*by\s+\S[^}]*\}"
+)
+CALC_REF_RE = re.compile(r"(single_lemma_\d+|history_lemma_\d+|a1)")
+CALC_LEMMA_RE = re.compile(r"lemma\s+(\d+)", re.IGNORECASE)
+WS_RE = re.compile(r'\s*')
+
+# Parser for op(...) terms into Lean infix ◇, iterative so that deep
+# nesting costs no Python frames and cannot hit the recursion limit.
+# Variables are renamed through renaming (case-insensitive) as they are read.
+def parse_term(s, i=0, renaming=None):
+    n = len(s)
+    # One entry per open op(...): None until its left operand is known
+    stack = []
+    while True:
+        i = WS_RE.match(s, i).end()
+        if i >= n:
+            raise ValueError("Unexpected end while parsing term")
+
+        if s.startswith("op(", i):
+            i += 3
+            stack.append(None)
+            continue
+
+        m = IDENT_RE.match(s, i)
+        if not m:
+            raise ValueError(f"Expected variable at pos {i} in: {s}")
+        cur = m.group(0)
+        if renaming is not None:
+            cur = renaming.get(cur.lower(), cur)
+        i = m.end()
+
+        # Close every op(...) whose right operand is now complete
+        while stack:
+            i = WS_RE.match(s, i).end()
+            if stack[-1] is None:
+                if i >= n or s[i] != ',':
+                    raise ValueError(f"Expected ',' in op(...) at pos {i} in: {s}")
+                i += 1
+                stack[-1] = cur
+                break
+            if i >= n or s[i] != ')':
+                raise ValueError(f"Expected ')' in op(...) at pos {i} in: {s}")
+            i += 1
+            cur = f"({stack.pop()} ◇ {cur})"
+        else:
+            return cur, i
+
+def normalize_variables(expr):
+    """
+    Renames variables in expr to x0, x1, x2, ... in sorted order.
+    Variable matching is case-insensitive: X and x map to the same variable.
+    Returns (new_expr, new_vars)
+    """
+
+    # Normalize case once for the whole expression
+    expr_lower = expr.lower()
+
+    # Extract variables and remove 'op'
+    canon_vars = canonical_variables(expr, expr_lower)
+
+    # Canonical renaming, interned: these are looked up once per identifier
+    renaming = {sys.intern(v): sys.intern(f"x{i}") for i, v in enumerate(canon_vars)}
+
+    new_expr = rename_lowered(expr, expr_lower, renaming)
+    new_vars = [renaming[v] for v in canon_vars]
+
+    return new_expr, new_vars
+
+def canonical_variables(expr, expr_lower):
+    """
+    Sorted lowercase variable names of expr, without 'op'.
+    expr_lower is expr.lower(); it is only scanned when expr is ASCII.
+    """
+    if expr.isascii():
+        seen = dict.fromkeys(IDENT_RE.findall(expr_lower))
+    else:
+        # lower() may turn other text into identifiers: lowercase per identifier
+        seen = dict.fromkeys(v.lower() for v in IDENT_RE.findall(expr))
+    # dedup keeps a dict, sort only once
+    seen.pop("op", None)
+    return sorted(seen)
+
+def apply_renaming(expr, renaming):
+    return rename_lowered(expr, expr.lower(), renaming)
+
+def rename_lowered(expr, expr_lower, renaming):
+    """
+    Replace each identifier of expr by renaming[its lowercase form], if any.
+    Matches run over expr_lower so no identifier is lowercased on its own;
+    identifiers without a renaming keep their original spelling.
+    """
+    if not expr.isascii():
+        # lower() may shift positions outside ASCII: lowercase per identifier
+        def repl(match):
+            v = match.group(0)
+            return renaming.get(v.lower(), v)
+        return IDENT_RE.sub(repl, expr)
+
+    def repl(match):
+        new = renaming.get(match.group(0))
+        return new if new is not None else expr[match.start():match.end()]
+    return IDENT_RE.sub(repl, expr_lower)
+
+def format_calc_step(lhs, rhs, dep, indent="        ", max_len=80):
+    expr_len = len(lhs) + len(rhs)
+
+    if expr_len <= max_len:
+        return (
+            f"{lhs} = {rhs} := by\n"
+            f"{indent}duper [{dep}]"
+        )
+    else:
+        return (
+            f"{lhs} =\n"
+            f"{indent}{rhs} := by\n"
+            f"{indent}duper [{dep}]"
+        )
+    
+def calc_step_ref(line):
+    """
+    Classify one stripped proof line, once, when it is read.
+    A calc step "= { by ... }" gives (key, default): its dependency is
+    name_mapping.get(key, default) once the lemma names are known.
+    Any other line gives None.
+    """
+    if not line.startswith("=") or not CALC_DEP_RE.match(line):
+        return None
+    # Determine dependency (only the first reference)
+    m = CALC_REF_RE.search(line)
+    if m:
+        r = m.group(1)
+        if r == "a1":
+            # None is never a lemma name, so this always resolves to op_law
+            return None, "op_law"
+        r = sys.intern(r)
+        return r, r
+    # Next, try "lemma N" pattern
+    m = CALC_LEMMA_RE.search(line)
+    if m:
+        # Original TPTP name may be "Lemma_3", map via name_mapping
+        return sys.intern(f"Lemma_{m.group(1)}"), f"lemma_{m.group(1)}"
+    # fallback: just take first word and translate if possible
+    word = sys.intern(line.split()[0])
+    return word, word
+
+def build_calc_block(proof_lines, renaming, name_mapping):
+    """
+    Builds Lean calc block from TPTP proof lines.
+    Each step may have:
+      lhs
+      = { by <dep> }
+      rhs
+
+    Converts to:
+      lhs = rhs := by duper [dep]
+
+    proof_lines holds (line, calc_step_ref(line)) pairs, so this is a
+    single walk with no regex matching.
+    """
+    lines = []
+
+    for i, (line, ref) in enumerate(proof_lines):
+        if ref is None:
+            continue
+        key, default = ref
+        dep = name_mapping.get(key, default)
+
+        lhs, _ = parse_term(proof_lines[i - 1][0], 0, renaming)
+        rhs, _ = parse_term(proof_lines[i + 1][0], 0, renaming)
+
+        lines.append(format_calc_step(lhs, rhs, dep))
+
+    return "\n      ".join(lines)
@@ -0,0 +1,210 @@
+# cython: language_level=3
+# Cython build of tolean_core.py; keep the two in sync.
+import re
+import sys
+
+try:
+    # regex has possessive quantifiers on any Python; re only from 3.11
+    import regex as re2
+    POSSESSIVE = True
+except ImportError:
+    re2 = re
+    POSSESSIVE = sys.version_info >= (3, 11)
+
+from cpython.unicode cimport PyUnicode_GET_LENGTH, PyUnicode_READ_CHAR, Py_UNICODE_ISSPACE
+
+# Regex patterns
+IDENT_RE = re.compile(r'[A-Za-z]\w*')
+DEP_RE = re2.compile(
+    r'\((single_lemma_\d++|history_lemma_\d++|a1)\)' if POSSESSIVE
+    else r'\((single_lemma_\d+|history_lemma_\d+|a1)\)'
+)
+# "= { by <dep> ... }": the [^}] scan bounds backtracking, possessive
+# runs (where supported) remove it
+CALC_DEP_RE = re2.compile(
+    r"=\s*+\{\s*+by\s++\S[^}]*+\}" if POSSESSIVE
+    else r"=\s*\{\s*by\s+\S[^}]*\}"
+)
+CALC_REF_RE = re.compile(r"(single_lemma_\d+|history_lemma_\d+|a1)")
+CALC_LEMMA_RE = re.compile(r"lemma\s+(\d+)", re.IGNORECASE)
+
+cdef inline Py_ssize_t skip_space(unicode s, Py_ssize_t i, Py_ssize_t n):
+    while i < n and Py_UNICODE_ISSPACE(PyUnicode_READ_CHAR(s, i)):
+        i += 1
+    return i
+
+# Parser for op(...) terms into Lean infix ◇, iterative so that deep
+# nesting costs no Python frames and cannot hit the recursion limit.
+# Variables are renamed through renaming (case-insensitive) as they are read.
+cpdef tuple parse_term(unicode s, Py_ssize_t i=0, dict renaming=None):
+    cdef Py_ssize_t n = PyUnicode_GET_LENGTH(s)
+    # One entry per open op(...): None until its left operand is known
+    cdef list stack = []
+    cdef unicode cur
+    while True:
+        i = skip_space(s, i, n)
+        if i >= n:
+            raise ValueError("Unexpected end while parsing term")
+
+        if (i + 2 < n and PyUnicode_READ_CHAR(s, i) == u'o'
+                and PyUnicode_READ_CHAR(s, i + 1) == u'p'
+                and PyUnicode_READ_CHAR(s, i + 2) == u'('):
+            i += 3
+            stack.append(None)
+            continue
+
+        m = IDENT_RE.match(s, i)
+        if not m:
+            raise ValueError(f"Expected variable at pos {i} in: {s}")
+        cur = m.group(0)
+        if renaming is not None:
+            cur = renaming.get(cur.lower(), cur)
+        i = m.end()
+
+        # Close every op(...) whose right operand is now complete
+        while stack:
+            i = skip_space(s, i, n)
+            if stack[-1] is None:
+                if i >= n or PyUnicode_READ_CHAR(s, i) != u',':
+                    raise ValueError(f"Expected ',' in op(...) at pos {i} in: {s}")
+                i += 1
+                stack[-1] = cur
+                break
+            if i >= n or PyUnicode_READ_CHAR(s, i) != u')':
+                raise ValueError(f"Expected ')' in op(...) at pos {i} in: {s}")
+            i += 1
+            cur = f"({stack.pop()} ◇ {cur})"
+        else:
+            return cur, i
+
+def normalize_variables(unicode expr):
+    """
+    Renames variables in expr to x0, x1, x2, ... in sorted order.
+    Variable matching is case-insensitive: X and x map to the same variable.
+    Returns (new_expr, new_vars)
+    """
+    cdef list canon_vars
+    cdef dict renaming
+    cdef unicode expr_lower
+
+    # Normalize case once for the whole expression
+    expr_lower = expr.lower()
+
+    # Extract variables and remove 'op'
+    canon_vars = canonical_variables(expr, expr_lower)
+
+    # Canonical renaming, interned: these are looked up once per identifier
+    renaming = {sys.intern(v): sys.intern(f"x{i}") for i, v in enumerate(canon_vars)}
+
+    new_expr = rename_lowered(expr, expr_lower, renaming)
+    new_vars = [renaming[v] for v in canon_vars]
+
+    return new_expr, new_vars
+
+def canonical_variables(unicode expr, unicode expr_lower):
+    """
+    Sorted lowercase variable names of expr, without 'op'.
+    expr_lower is expr.lower(); it is only scanned when expr is ASCII.
+    """
+    cdef dict seen
+    if expr.isascii():
+        seen = dict.fromkeys(IDENT_RE.findall(expr_lower))
+    else:
+        # lower() may turn other text into identifiers: lowercase per identifier
+        seen = dict.fromkeys(v.lower() for v in IDENT_RE.findall(expr))
+    # dedup keeps a dict, sort only once
+    seen.pop("op", None)
+    return sorted(seen)
+
+def apply_renaming(unicode expr, dict renaming):
+    return rename_lowered(expr, expr.lower(), renaming)
+
+def rename_lowered(unicode expr, unicode expr_lower, dict renaming):
+    """
+    Replace each identifier of expr by renaming[its lowercase form], if any.
+    Matches run over expr_lower so no identifier is lowercased on its own;
+    identifiers without a renaming keep their original spelling.
+    """
+    if not expr.isascii():
+        # lower() may shift positions outside ASCII: lowercase per identifier
+        def repl_each(match):
+            v = match.group(0)
+            return renaming.get(v.lower(), v)
+        return IDENT_RE.sub(repl_each, expr)
+
+    def repl(match):
+        new = renaming.get(match.group(0))
+        return new if new is not None else expr[match.start():match.end()]
+    return IDENT_RE.sub(repl, expr_lower)
+
+def format_calc_step(lhs, rhs, dep, indent="        ", Py_ssize_t max_len=80):
+    cdef Py_ssize_t expr_len = len(lhs) + len(rhs)
+
+    if expr_len <= max_len:
+        return (
+            f"{lhs} = {rhs} := by\n"
+            f"{indent}duper [{dep}]"
+        )
+    else:
+        return (
+            f"{lhs} =\n"
+            f"{indent}{rhs} := by\n"
+            f"{indent}duper [{dep}]"
+        )
+
+def calc_step_ref(unicode line):
+    """
+    Classify one stripped proof line, once, when it is read.
+    A calc step "= { by ... }" gives (key, default): its dependency is
+    name_mapping.get(key, default) once the lemma names are known.
+    Any other line gives None.
+    """
+    if not line.startswith("=") or not CALC_DEP_RE.match(line):
+        return None
+    # Determine dependency (only the first reference)
+    m = CALC_REF_RE.search(line)
+    if m:
+        r = m.group(1)
+        if r == "a1":
+            # None is never a lemma name, so this always resolves to op_law
+            return None, "op_law"
+        r = sys.intern(r)
+        return r, r
+    # Next, try "lemma N" pattern
+    m = CALC_LEMMA_RE.search(line)
+    if m:
+        # Original TPTP name may be "Lemma_3", map via name_mapping
+        return sys.intern(f"Lemma_{m.group(1)}"), f"lemma_{m.group(1)}"
+    # fallback: just take first word and translate if possible
+    word = sys.intern(line.split()[0])
+    return word, word
+
+def build_calc_block(list proof_lines, dict renaming, dict name_mapping):
+    """
+    Builds Lean calc block from TPTP proof lines.
+    Each step may have:
+      lhs
+      = { by <dep> }
+      rhs
+
+    Converts to:
+      lhs = rhs := by duper [dep]
+
+    proof_lines holds (line, calc_step_ref(line)) pairs, so this is a
+    single walk with no regex matching.
+    """
+    cdef list lines = []
+    cdef Py_ssize_t i
+
+    for i, (line, ref) in enumerate(proof_lines):
+        if ref is None:
+            continue
+        key, default = ref
+        dep = name_mapping.get(key, default)
+
+        lhs, _ = parse_term(proof_lines[i - 1][0], 0, renaming)
+        rhs, _ = parse_term(proof_lines[i + 1][0], 0, renaming)
+
+        lines.append(format_calc_step(lhs, rhs, dep))
+
+    return "\n      ".join(lines)